@@ -1,54 +1,214 @@
 
 
 #!/usr/bin/env python3
+import os
+import re
 import sys
+import select
 import subprocess
 import threading
 import shutil
+import socket
+import time
+import collections
 from pathlib import Path
 
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QPushButton, QLabel, QVBoxLayout, QHBoxLayout,
-    QTextEdit, QFileDialog, QLineEdit, QMessageBox, QComboBox
+    QTextEdit, QFileDialog, QLineEdit, QMessageBox, QComboBox, QSpinBox
 )
-from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtGui import QTextCursor
+from PyQt6.QtCore import Qt, QTimer, QObject, QProcess, QStringListModel, pyqtSignal
 
 # --- Verbesserte Prüfung für adb & scrcpy ---
 ADB = shutil.which("adb")
 SCRCPY = shutil.which("scrcpy")
 
-if not ADB:
-    sys.stderr.write("Fehler: 'adb' nicht gefunden. Bitte installiere adb und füge es zum PATH hinzu.\n")
-    sys.exit(1)
+# Obergrenze für einen adb-Aufruf per QProcess, danach wird er abgebrochen
+ADB_TIMEOUT_MS = 10000
 
-if not SCRCPY:
-    sys.stderr.write("Fehler: 'scrcpy' nicht gefunden. Bitte installiere scrcpy und füge es zum PATH hinzu.\n")
-    sys.exit(1)
+class AsyncAdb(QObject):
+    # Führt adb-Befehle per QProcess aus, damit der GUI-Thread nicht blockiert.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._procs = set()
+        self._timed_out = set()
 
-def run_cmd(cmd):
-    try:
-        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=False)
-        return p.returncode, p.stdout.strip(), p.stderr.strip()
-    except FileNotFoundError as e:
-        return 127, "", str(e)
+    def run(self, args, callback, timeout_ms=ADB_TIMEOUT_MS):
+        proc = QProcess(self)
+        self._procs.add(proc)
+        # Ein hängender adb-Server darf den Callback nicht für immer ausbleiben lassen
+        timer = QTimer(proc)
+        timer.setSingleShot(True)
+        timer.timeout.connect(lambda: self._on_timeout(proc))
+        proc.finished.connect(timer.stop)
+        proc.finished.connect(lambda code, status: self._on_finished(proc, code, callback))
+        proc.errorOccurred.connect(lambda error: self._on_error(proc, error, callback))
+        proc.start(ADB, args)
+        timer.start(timeout_ms)
 
-def adb_cmd(cmd_args):
-    return run_cmd([ADB] + cmd_args)
+    def _on_timeout(self, proc):
+        self._timed_out.add(proc)
+        proc.kill()
+
+    def _done(self, proc, callback, code, out, err):
+        self._procs.discard(proc)
+        proc.deleteLater()
+        callback(code, out, err)
+
+    def _on_finished(self, proc, code, callback):
+        out = bytes(proc.readAllStandardOutput()).decode("utf-8", "replace").strip()
+        err = bytes(proc.readAllStandardError()).decode("utf-8", "replace").strip()
+        if proc in self._timed_out:
+            self._timed_out.discard(proc)
+            code, err = 124, "Zeitüberschreitung bei adb " + " ".join(proc.arguments())
+        self._done(proc, callback, code, out, err)
+
+    def _on_error(self, proc, error, callback):
+        # Bei FailedToStart wird finished nie ausgelöst
+        if error == QProcess.ProcessError.FailedToStart:
+            self._done(proc, callback, 127, "", proc.errorString())
+
+class AdbClient:
+    # Spricht direkt mit dem laufenden adb-Server statt pro Abfrage den adb-Client zu starten.
+    # Host-Dienste wie host:devices-l schließen die Verbindung nach der Antwort,
+    # daher wird pro Abfrage neu verbunden (localhost, kein fork/exec).
+    def __init__(self, host="127.0.0.1", port=5037, timeout=2.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._version = None
+
+    def _recv_exact(self, sock, n):
+        buf = b""
+        while len(buf) < n:
+            chunk = sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionResetError("adb-Server hat die Verbindung geschlossen")
+            buf += chunk
+        return buf
+
+    def _request(self, sock, cmd):
+        data = cmd.encode("utf-8")
+        sock.sendall(b"%04x%s" % (len(data), data))
+        status = self._recv_exact(sock, 4)
+        size = int(self._recv_exact(sock, 4), 16)
+        payload = self._recv_exact(sock, size).decode("utf-8", "replace")
+        if status != b"OKAY":
+            raise OSError(payload or status.decode("ascii", "replace"))
+        return payload
+
+    def query(self, cmd):
+        for attempt in range(2):
+            with socket.create_connection((self.host, self.port), timeout=self.timeout) as sock:
+                try:
+                    return self._request(sock, cmd)
+                except (ConnectionResetError, BrokenPipeError):
+                    if attempt:
+                        raise
+
+    def devices(self):
+        return self.query("host:devices-l")
+
+    def server_version(self):
+        if self._version is None:
+            self._version = int(self.query("host:version"), 16)
+        return self._version
+
+# Rückgabecode von _query_devices, wenn kein adb-Server auf dem Port lauscht
+ADB_NO_SERVER = -1
+
+# --- Polling-Intervall (adaptiv, nur Fallback wenn track-devices nicht läuft) ---
+POLL_MIN_MS = 500
+POLL_MAX_MS = 60000
+TRACKER_MIN_UPTIME_S = 5
+
+# Eine Zeile pro betriebsbereitem Gerät: "<serial> device <Details>"
+_DEV_RE = re.compile(r"^(\S+)[ \t]+device\b[ \t]*(.*)$", re.M)
+
+# --- Log-Fenster ---
+LOG_FLUSH_MS = 50
+LOG_MAX_LINES = 2000
+LOG_FLUSH_BATCH = 500
+
+class DeviceTracker(QObject):
+    changed = pyqtSignal()
+    stopped = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.proc = None
+        self.started_at = 0.0
+        self._stopping = False
+
+    def start(self):
+        self._stopping = False
+        self.started_at = time.monotonic()
+        try:
+            self.proc = subprocess.Popen([ADB, "track-devices"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError:
+            self.stopped.emit()
+            return
+        threading.Thread(target=self._reader, args=(self.proc,), daemon=True).start()
+
+    def is_running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def _reader(self, proc):
+        # adb schreibt pro Zustandsänderung "<Länge als 4 Hex-Zeichen><Geräteliste>"
+        stream = proc.stdout
+        while True:
+            head = stream.read(4)
+            if len(head) < 4:
+                break
+            try:
+                size = int(head, 16)
+            except ValueError:
+                break
+            if size and len(stream.read(size)) < size:
+                break
+            self.changed.emit()
+        proc.wait()
+        if not self._stopping:
+            self.stopped.emit()
+
+    def stop(self):
+        self._stopping = True
+        if self.is_running():
+            self.proc.terminate()
 
 class DexApp(QWidget):
+    scrcpy_line = pyqtSignal(str)
+    scrcpy_stopped = pyqtSignal(int)
+    devices_queried = pyqtSignal(int, str, str)
+    adb_version_found = pyqtSignal(int)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Linux Dex (Prototype)")
         self.resize(700, 480)
 
         self.device_combo = QComboBox()
+        self._device_model = QStringListModel(self)
+        self.device_combo.setModel(self._device_model)
         self.refresh_btn = QPushButton("Geräte aktualisieren")
         self.connect_btn = QPushButton("Autorisiere / Verbindung prüfen")
         self.launch_btn = QPushButton("scrcpy starten (DeX-Ansicht)")
         self.stop_scrcpy_btn = QPushButton("scrcpy stoppen")
+        self.poll_spin = QSpinBox()
+        self.poll_spin.setRange(1, POLL_MAX_MS // 1000)
+        self.poll_spin.setValue(POLL_MAX_MS // 1000)
+        self.poll_spin.setSuffix(" s")
+        self.poll_spin.setToolTip("Maximales Abfrage-Intervall, falls adb track-devices nicht verfügbar ist")
 
         self.log = QTextEdit()
         self.log.setReadOnly(True)
+        self.log.document().setMaximumBlockCount(LOG_MAX_LINES)
+        self._log_queue = collections.deque()
+        self._log_timer = QTimer()
+        self._log_timer.setSingleShot(True)
+        self._log_timer.setInterval(LOG_FLUSH_MS)
+        self._log_timer.timeout.connect(self._flush_log)
 
         top_row = QHBoxLayout()
         top_row.addWidget(QLabel("Device:"))
@@ -59,6 +219,8 @@ class DexApp(QWidget):
         mid_row = QHBoxLayout()
         mid_row.addWidget(self.launch_btn)
         mid_row.addWidget(self.stop_scrcpy_btn)
+        mid_row.addWidget(QLabel("Max. Intervall:"))
+        mid_row.addWidget(self.poll_spin)
 
         main = QVBoxLayout()
         main.addLayout(top_row)
@@ -68,46 +230,171 @@ class DexApp(QWidget):
         self.setLayout(main)
 
         self.scrcpy_proc = None
+        self._cached_device = None
+        self._scrcpy_stop = threading.Event()
+        self.adb_client = AdbClient()
+        self.adb_async = AsyncAdb(self)
+        self._devices_busy = False
+        self._devices_dirty = False
+        self._poll_interval_ms = POLL_MIN_MS
+        self._poll_max_ms = POLL_MAX_MS
+        self._last_devices = None
+        self._last_devices_out = None
 
         self.refresh_btn.clicked.connect(self.refresh_devices)
         self.connect_btn.clicked.connect(self.check_connection)
         self.launch_btn.clicked.connect(self.start_scrcpy)
         self.stop_scrcpy_btn.clicked.connect(self.stop_scrcpy)
+        self.poll_spin.valueChanged.connect(self._set_poll_max)
+        self.device_combo.currentTextChanged.connect(self._on_device_changed)
+        if not SCRCPY:
+            self.launch_btn.setEnabled(False)
+            self.stop_scrcpy_btn.setEnabled(False)
+            self.launch_btn.setToolTip("scrcpy nicht im PATH gefunden")
+            self.log_msg("scrcpy nicht gefunden, Start deaktiviert.")
+        self.scrcpy_line.connect(lambda line: self.log_msg("[scrcpy]", line))
+        self.scrcpy_stopped.connect(lambda code: self.log_msg("scrcpy gestoppt. Exit-Code:", code))
+        self.devices_queried.connect(self._on_devices_queried)
+        self.adb_version_found.connect(lambda version: self.log_msg("adb-Server Version:", version))
+        threading.Thread(target=self._probe_adb_version, daemon=True).start()
 
         self.timer = QTimer()
+        self.timer.setSingleShot(True)
         self.timer.timeout.connect(self.refresh_devices)
-        self.timer.start(5000)
+
+        self.tracker = DeviceTracker(self)
+        self.tracker.changed.connect(self.refresh_devices)
+        self.tracker.stopped.connect(self._on_tracker_stopped)
+        self.tracker.start()
 
         self.refresh_devices()
 
+    def closeEvent(self, event):
+        self.tracker.stop()
+        super().closeEvent(event)
+
     def log_msg(self, *parts):
-        self.log.append(" ".join(str(p) for p in parts))
-        self.log.verticalScrollBar().setValue(self.log.verticalScrollBar().maximum())
+        self._log_queue.append(" ".join(str(p) for p in parts))
+        if not self._log_timer.isActive():
+            self._log_timer.start()
+
+    def _flush_log(self):
+        if not self._log_queue:
+            return
+        n = min(len(self._log_queue), LOG_FLUSH_BATCH)
+        chunk = "\n".join(self._log_queue.popleft() for _ in range(n))
+        bar = self.log.verticalScrollBar()
+        at_bottom = bar.value() >= bar.maximum()
+        # Ausdrücklich als Klartext einfügen: append() würde den ganzen Block anhand
+        # der ersten Zeile eventuell als HTML interpretieren
+        cursor = QTextCursor(self.log.document())
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        if not self.log.document().isEmpty():
+            chunk = "\n" + chunk
+        cursor.insertText(chunk)
+        if at_bottom:
+            bar.setValue(bar.maximum())
+        if self._log_queue:
+            self._log_timer.start()
 
     def get_selected_device(self):
-        txt = self.device_combo.currentText()
-        if not txt:
-            return None
-        return txt.split()[0]
+        return self._cached_device
+
+    def _on_device_changed(self, text):
+        self._cached_device = text.split(None, 1)[0] if text and not text.startswith("<") else None
 
     def refresh_devices(self):
-        code, out, err = adb_cmd(["devices", "-l"])
+        # Immer nur eine Abfrage gleichzeitig; Anstöße währenddessen lösen genau eine weitere aus
+        if self._devices_busy:
+            self._devices_dirty = True
+            return
+        self._devices_busy = True
+        self._devices_dirty = False
+        threading.Thread(target=self._query_devices, daemon=True).start()
+
+    def _query_devices(self):
+        # Läuft im Worker-Thread, damit ein hängender adb-Server die GUI nicht blockiert
+        try:
+            self.devices_queried.emit(0, self.adb_client.devices(), "")
+        except ConnectionRefusedError:
+            self.devices_queried.emit(ADB_NO_SERVER, "", "")
+        except (OSError, ValueError) as e:
+            # Server läuft, antwortet aber nicht sinnvoll: ein adb-Client hinge am selben Server
+            self.devices_queried.emit(1, "", "adb-Server antwortet nicht: %s" % (str(e) or type(e).__name__))
+
+    def _probe_adb_version(self):
+        try:
+            self.adb_version_found.emit(self.adb_client.server_version())
+        except (OSError, ValueError):
+            pass
+
+    def _on_devices_queried(self, code, out, err):
+        if code == 0 and not self.tracker.is_running():
+            # Server antwortet wieder (z. B. nach adb kill-server): zurück zu track-devices
+            self.tracker.start()
+        if code == ADB_NO_SERVER:
+            # Kein Server aktiv: adb-Client startet ihn bei Bedarf
+            self.adb_async.run(["devices", "-l"], self._on_devices_done)
+        else:
+            self._on_devices_done(code, out, err)
+
+    def _on_devices_done(self, code, out, err):
+        self._devices_busy = False
+        if self._devices_dirty:
+            QTimer.singleShot(0, self.refresh_devices)
         if code != 0:
             self.log_msg("adb Fehler:", err)
-            self.device_combo.clear()
+            self._device_model.setStringList([])
+            self._last_devices = None
+            self._last_devices_out = None
+            self._schedule_poll(False)
+            return
+        if out == self._last_devices_out:
+            self._schedule_poll(False)
             return
-        lines = [l.strip() for l in out.splitlines() if l.strip()]
-        devices = []
-        for l in lines[1:]:
-            parts = l.split()
-            if parts:
-                devices.append(parts[0])
-        self.device_combo.clear()
-        self.device_combo.addItems(devices if devices else ["<kein Gerät>"])
+        self._last_devices_out = out
+        devices = [(m.group(1) + " " + m.group(2).strip()).rstrip() for m in _DEV_RE.finditer(out)]
+        new = tuple(devices)
+        changed = new != self._last_devices
+        self._schedule_poll(changed)
+        if not changed:
+            return
+        self._last_devices = new
+        prev = self.get_selected_device()
+        self._device_model.setStringList(devices if devices else ["<kein Gerät>"])
+        if prev:
+            idx = next((i for i, d in enumerate(devices) if d.split(None, 1)[0] == prev), -1)
+            if idx >= 0:
+                self.device_combo.setCurrentIndex(idx)
         self.log_msg("Gefundene Geräte:", len(devices))
 
+    def _schedule_poll(self, changed):
+        if changed:
+            self._poll_interval_ms = POLL_MIN_MS
+        else:
+            self._poll_interval_ms = min(self._poll_interval_ms * 2, self._poll_max_ms)
+        if not self.tracker.is_running():
+            self.timer.start(self._poll_interval_ms)
+
+    def _set_poll_max(self, seconds):
+        self._poll_max_ms = seconds * 1000
+        if self._poll_interval_ms > self._poll_max_ms:
+            self._poll_interval_ms = self._poll_max_ms
+            if self.timer.isActive():
+                self.timer.start(self._poll_interval_ms)
+
+    def _on_tracker_stopped(self):
+        # Bricht track-devices sofort wieder ab, nicht auf das Minimum zurücksetzen,
+        # sonst wechseln Neustart und 0,5-s-Polling endlos
+        if time.monotonic() - self.tracker.started_at >= TRACKER_MIN_UPTIME_S:
+            self.log_msg("adb track-devices beendet, wechsle auf Polling.")
+            self._poll_interval_ms = POLL_MIN_MS
+        self.timer.start(self._poll_interval_ms)
+
     def check_connection(self):
-        code, out, err = adb_cmd(["get-state"])
+        self.adb_async.run(["get-state"], self._on_connection_done)
+
+    def _on_connection_done(self, code, out, err):
         if code == 0 and out.strip() == "device":
             self.log_msg("ADB: Gerät verbunden")
         else:
@@ -115,7 +402,7 @@ class DexApp(QWidget):
 
     def start_scrcpy(self):
         device = self.get_selected_device()
-        if not device or device.startswith("<"):
+        if not device:
             QMessageBox.warning(self, "Kein Gerät", "Bitte Gerät auswählen.")
             return
         if self.scrcpy_proc and self.scrcpy_proc.poll() is None:
@@ -124,26 +411,67 @@ class DexApp(QWidget):
         cmd = [SCRCPY, "-s", device, "--stay-awake", "--max-size", "1280"]
         self.log_msg("Starte scrcpy:", " ".join(cmd))
         try:
-            self.scrcpy_proc = subprocess.Popen(cmd, stderr=subprocess.PIPE, text=True)
-            threading.Thread(target=self._scrcpy_reader, daemon=True).start()
+            self.scrcpy_proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            self._scrcpy_stop = threading.Event()
+            threading.Thread(target=self._scrcpy_reader, args=(self.scrcpy_proc, self._scrcpy_stop), daemon=True).start()
         except FileNotFoundError as e:
             self.log_msg("scrcpy nicht gefunden:", e)
 
-    def _scrcpy_reader(self):
-        if not self.scrcpy_proc:
-            return
-        for line in self.scrcpy_proc.stderr:
-            self.log_msg("[scrcpy]", line.strip())
+    def _scrcpy_reader(self, proc, stop):
+        # Nicht-blockierend bis EOF lesen, damit die Pipe nie vollläuft und auch die
+        # Meldungen beim Beenden ankommen; Zeilen gehen per Signal an den GUI-Thread.
+        # Das Stop-Event greift erst, wenn scrcpy bereits beendet und eingesammelt ist
+        # (z. B. falls ein Kindprozess die Pipe noch offen hält).
+        fd = proc.stderr.fileno()
+        os.set_blocking(fd, False)
+        buf = b""
+        while True:
+            ready, _, _ = select.select([fd], [], [], 0.1)
+            if not ready:
+                if stop.is_set() and proc.returncode is not None:
+                    break
+                continue
+            try:
+                chunk = os.read(fd, 4096)
+            except BlockingIOError:
+                continue
+            if not chunk:
+                break
+            *lines, buf = (buf + chunk).split(b"\n")
+            for line in lines:
+                self.scrcpy_line.emit(line.decode("utf-8", "replace").strip())
+        if buf:
+            self.scrcpy_line.emit(buf.decode("utf-8", "replace").strip())
+        proc.stderr.close()
 
     def stop_scrcpy(self):
         if self.scrcpy_proc and self.scrcpy_proc.poll() is None:
-            self.scrcpy_proc.terminate()
-            self.scrcpy_proc.wait(timeout=3)
-            self.log_msg("scrcpy gestoppt.")
+            if self._scrcpy_stop.is_set():
+                return
+            self._scrcpy_stop.set()
+            threading.Thread(target=self._terminate_scrcpy_async, args=(self.scrcpy_proc,), daemon=True).start()
         else:
             self.log_msg("Kein scrcpy Prozess aktiv.")
 
+    def _terminate_scrcpy_async(self, proc):
+        # SIGTERM, 1 s Gnadenfrist, dann SIGKILL - ohne den GUI-Thread zu blockieren
+        proc.terminate()
+        try:
+            proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        self.scrcpy_stopped.emit(proc.returncode)
+
 def main():
+    # Erst hier prüfen, damit ein reiner Import des Moduls nicht abbricht
+    if not ADB:
+        sys.stderr.write("Fehler: 'adb' nicht gefunden. Bitte installiere adb und füge es zum PATH hinzu.\n")
+        sys.exit(1)
+
+    if not SCRCPY:
+        sys.stderr.write("Warnung: 'scrcpy' nicht gefunden. Bitte installiere scrcpy und füge es zum PATH hinzu.\n")
+
     app = QApplication(sys.argv)
     w = DexApp()
     w.show()